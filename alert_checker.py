@@ -1,102 +1,78 @@
 import os
-import requests
-import sqlite3
+import asyncio
 import logging
-import time
 
-from telegram import Bot
-from db import get_db_connection, get_all_active_alerts, deactivate_alert # Import DB functions
+from telegram.ext import ContextTypes
+
+from coingecko import get_cached_prices, get_current_prices_for_symbols
+from db import get_min_target_prices, get_triggered_alerts, deactivate_alerts # Import DB functions (blocking; call via asyncio.to_thread)
 
-# Enable logging
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # --- Configuration ---
-TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
-COINGECKO_API_BASE = "https://api.coingecko.com/api/v3"
+MAX_CONCURRENT_SENDS = 5 # In-flight send_message calls; keeps us well under Telegram's 30 msg/s cap
+# Oldest cached price a sweep may act on. Keep it below ALERT_CHECK_INTERVAL: then a sweep only
+# reuses prices that something else (e.g. /price) fetched since the previous sweep, and otherwise
+# fetches fresh ones, regardless of PRICE_CACHE_TTL.
+ALERT_PRICE_MAX_AGE = float(os.environ.get("ALERT_PRICE_MAX_AGE", "30"))
 
-# Initialize the Bot outside the function to avoid recreating on each run
-if TELEGRAM_BOT_TOKEN:
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
-else:
-    logger.error("TELEGRAM_BOT_TOKEN not set for alert_checker.py. Alerts cannot be sent.")
-    bot = None # Handle case where token is missing
+async def send_alert(bot, semaphore, alert_id, chat_id, message):
+    """Sends one alert notification, returning the alert ID on success or None on failure."""
+    async with semaphore:
+        try:
+            await bot.send_message(chat_id=chat_id, text=message)
+            return alert_id
+        except Exception as e:
+            logger.error(f"Failed to send alert {alert_id} to chat {chat_id}: {e}")
+            return None
 
-def get_current_prices_for_symbols(symbols):
-    """Fetches current prices for a list of symbols from CoinGecko."""
-    if not symbols:
-        return {}
-    try:
-        ids = ",".join(s.lower() for s in symbols)
-        response = requests.get(f"{COINGECKO_API_BASE}/simple/price?ids={ids}&vs_currencies=usd")
-        response.raise_for_status()
-        data = response.json()
-        return {k.upper(): v['usd'] for k, v in data.items()}
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error fetching prices for alert check: {e}")
-        return {}
+async def check_and_send_alerts(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """JobQueue callback: checks all active alerts and sends notifications if triggered.
 
-def check_and_send_alerts():
-    """Checks all active alerts and sends notifications if triggered."""
-    if not bot:
-        logger.error("Bot is not initialized. Cannot send alerts.")
+    Prices up to ALERT_PRICE_MAX_AGE seconds old are reused, both to skip the sweep
+    when no alert can trigger and for the trigger check itself. An alert can
+    therefore fire up to ALERT_CHECK_INTERVAL + ALERT_PRICE_MAX_AGE seconds after
+    its price is first reached, instead of ALERT_CHECK_INTERVAL.
+    """
+    min_targets = await asyncio.to_thread(get_min_target_prices)
+    if not min_targets:
+        logger.info("No active alerts to check.")
         return
 
-    alerts = get_all_active_alerts()
-    if not alerts:
-        logger.info("No active alerts to check.")
+    # Fast path: every symbol has a fresh cached price below its lowest target, so nothing can trigger
+    cached_prices = get_cached_prices(min_targets, ALERT_PRICE_MAX_AGE)
+    if len(cached_prices) == len(min_targets) and all(cached_prices[s] < min_targets[s] for s in min_targets):
+        logger.info("Cached prices are below every alert target. Skipping this sweep.")
         return
 
-    # Get unique symbols to fetch prices efficiently
-    unique_symbols = list(set(alert['symbol'] for alert in alerts))
-    current_prices = get_current_prices_for_symbols(unique_symbols)
+    current_prices = await get_current_prices_for_symbols(list(min_targets), ALERT_PRICE_MAX_AGE)
 
     if not current_prices:
         logger.warning("Could not fetch any current prices for active alerts.")
         return
 
-    triggered_alerts = []
+    for symbol in min_targets.keys() - current_prices.keys():
+        logger.warning(f"Could not get current price for {symbol}. Skipping its alerts.")
 
-    for alert in alerts:
-        symbol = alert['symbol'].upper()
+    # Simple logic: Trigger if current price meets or exceeds target price.
+    # The comparison runs in SQLite, so only triggered alerts are loaded.
+    pending_sends = []
+    for alert in await asyncio.to_thread(get_triggered_alerts, current_prices):
+        symbol = alert['symbol']
         target_price = alert['target_price']
-        alert_id = alert['id']
-        chat_id = alert['chat_id']
+        current_price = current_prices[symbol]
+        message = (f"🚨 Price Alert for {symbol}! 🚨\n"
+                   f"Your target: ${target_price:,.2f}\n"
+                   f"Current price: ${current_price:,.2f}")
+        pending_sends.append((alert['id'], alert['chat_id'], message))
+        logger.info(f"Alert {alert['id']} triggered for {symbol} (Target: {target_price}, Current: {current_price})")
 
-        if symbol in current_prices:
-            current_price = current_prices[symbol]
-            # Simple logic: Trigger if current price meets or exceeds target price
-            # You might want more complex logic (e.g., target below price, target above price)
-            if current_price >= target_price:
-                message = (f"🚨 Price Alert for {symbol}! 🚨\n"
-                           f"Your target: ${target_price:,.2f}\n"
-                           f"Current price: ${current_price:,.2f}")
-                try:
-                    bot.send_message(chat_id=chat_id, text=message)
-                    triggered_alerts.append(alert_id)
-                    logger.info(f"Alert {alert_id} triggered for {symbol} (Target: {target_price}, Current: {current_price})")
-                except Exception as e:
-                    logger.error(f"Failed to send alert {alert_id} to chat {chat_id}: {e}")
-            else:
-                logger.info(f"Alert {alert_id} for {symbol}: Not triggered (Current: {current_price}, Target: {target_price})")
-        else:
-            logger.warning(f"Could not get current price for {symbol} (Alert ID: {alert_id}). Skipping.")
+    # Send notifications concurrently; only alerts that were delivered get deactivated
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+    results = await asyncio.gather(*(send_alert(context.bot, semaphore, *send) for send in pending_sends))
+    triggered_alerts = [alert_id for alert_id in results if alert_id is not None]
 
-    # Deactivate all triggered alerts
-    for alert_id in triggered_alerts:
-        deactivate_alert(alert_id)
+    # Deactivate all triggered alerts in one transaction
     if triggered_alerts:
+        await asyncio.to_thread(deactivate_alerts, triggered_alerts)
         logger.info(f"Deactivated {len(triggered_alerts)} triggered alerts.")
-
-if __name__ == '__main__':
-    if not TELEGRAM_BOT_TOKEN:
-        logger.error("TELEGRAM_BOT_TOKEN environment variable not set. Exiting alert checker.")
-        exit(1)
-    
-    # Ensure DB is initialized before checking alerts (important for first run)
-    from db import init_db
-    init_db()
-    
-    check_and_send_alerts()
-    logger.info("Alert checker run completed.")
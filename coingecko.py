@@ -0,0 +1,229 @@
+import os
+import asyncio
+import logging
+import time
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+COINGECKO_API_BASE = "https://api.coingecko.com/api/v3"
+PRICE_CACHE_TTL = float(os.environ.get("PRICE_CACHE_TTL", "60")) # Seconds a fetched price stays fresh
+SYMBOL_MAP_TTL = 24 * 60 * 60 # Refresh the CoinGecko symbol -> id map daily
+SYMBOL_MAP_RETRY = 5 * 60 # After a failed load, wait this long before downloading /coins/list again
+MARKET_RANK_PAGES = 2 # /coins/markets pages (250 coins each, by market cap) used to rank shared tickers
+REQUESTS_PER_MINUTE = int(os.environ.get("COINGECKO_REQUESTS_PER_MINUTE", "50")) # Stay under the free-tier cap
+MAX_ATTEMPTS = 5 # Tries per request before giving up on 429/5xx or connection errors
+BACKOFF_FACTOR = 1.0 # Seconds; doubled after each failed attempt when there is no Retry-After
+RETRY_BUDGET = 12 # Seconds; give up once the next retry would end past this, counting from the first try
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Tickers shared by many coins in /coins/list; pin them to the coin users almost always mean.
+# Other shared tickers go to the highest market-cap coin, see build_symbol_map().
+PREFERRED_COIN_IDS = {
+    "btc": "bitcoin", "eth": "ethereum", "usdt": "tether", "usdc": "usd-coin",
+    "bnb": "binancecoin", "sol": "solana", "xrp": "ripple", "ada": "cardano",
+    "doge": "dogecoin", "trx": "tron", "dot": "polkadot", "ltc": "litecoin",
+    "link": "chainlink", "matic": "matic-network", "avax": "avalanche-2",
+}
+
+# Upper-case symbol -> (price_usd, fetched_at). Shared by /price and the alert job.
+# Handlers run concurrently, but each read and each write happens without an await in
+# between, so no lock is needed; two concurrent misses for one symbol just both fetch it.
+_price_cache = {}
+
+# Lowercase symbol -> CoinGecko coin id, loaded at startup and refreshed every SYMBOL_MAP_TTL.
+# refresh_at is a time.monotonic() deadline; None means the map has never been loaded.
+# Seeded with the pinned tickers so the major coins resolve even if /coins/list is down.
+_symbol_map = {"refresh_at": None, "ids": dict(PREFERRED_COIN_IDS)}
+_symbol_map_lock = asyncio.Lock() # Concurrent callers share one /coins/list download
+
+# Shared async HTTP client so concurrent callers don't block each other on CoinGecko.
+# Keep-alive connections are reused so the TLS handshake is paid once, not per request.
+_http_client = httpx.AsyncClient(
+    timeout=10,
+    limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+)
+
+class RateLimiter:
+    """Token bucket allowing `rate` requests per `per` seconds, with bursts of up to `rate`."""
+
+    def __init__(self, rate, per=60.0):
+        self._capacity = rate
+        self._tokens = float(rate)
+        self._fill_rate = rate / per
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Waits until a request may be sent, then consumes one token."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._fill_rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._fill_rate)
+
+_rate_limiter = RateLimiter(REQUESTS_PER_MINUTE)
+
+def _retry_delay(response, attempt):
+    """Seconds to wait before the next attempt, honouring a numeric Retry-After header."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return BACKOFF_FACTOR * 2 ** attempt
+
+async def _get(url):
+    """GETs a CoinGecko URL under the shared rate limit, retrying transient failures.
+
+    Retries stop after MAX_ATTEMPTS, or as soon as the next wait would end more
+    than RETRY_BUDGET seconds after the first try (timeouts and rate-limit waits
+    included), so a CoinGecko outage can't hold a caller for minutes.
+    Returns the last response (callers still call raise_for_status) or raises
+    the last transport error.
+    """
+    deadline = time.monotonic() + RETRY_BUDGET
+    for attempt in range(MAX_ATTEMPTS):
+        await _rate_limiter.acquire()
+        error = None
+        try:
+            response = await _http_client.get(url)
+        except httpx.TransportError as e:
+            response, error = None, e
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                return response
+        delay = _retry_delay(response, attempt)
+        if attempt == MAX_ATTEMPTS - 1 or time.monotonic() + delay > deadline:
+            if error is not None:
+                raise error
+            return response
+        reason = error if error is not None else f"HTTP {response.status_code}"
+        logger.warning(f"CoinGecko request failed ({reason}); retrying in {delay:.1f}s.")
+        await asyncio.sleep(delay)
+
+def build_symbol_map(coins, ranked_coins=()):
+    """Builds a lowercase symbol -> CoinGecko id map from the /coins/list payload.
+
+    A ticker shared by several coins resolves to, in order: its PREFERRED_COIN_IDS
+    pin, the highest market-cap coin in ranked_coins (a /coins/markets payload,
+    sorted by market cap), or else the first /coins/list entry. Coin ids map to
+    themselves as well, so '/price bitcoin' keeps working.
+    """
+    symbol_map = dict(PREFERRED_COIN_IDS)
+    for coin in ranked_coins:
+        symbol_map.setdefault(coin['symbol'].lower(), coin['id'])
+    for coin in coins:
+        symbol_map.setdefault(coin['symbol'].lower(), coin['id'])
+    for coin in coins:
+        symbol_map.setdefault(coin['id'], coin['id'])
+    return symbol_map
+
+async def fetch_ranked_coins():
+    """Fetches the top coins by market cap from /coins/markets; returns [] on failure.
+
+    Only used to break ticker ties, so a failure here doesn't fail the symbol map load.
+    """
+    ranked = []
+    try:
+        for page in range(1, MARKET_RANK_PAGES + 1):
+            response = await _get(
+                f"{COINGECKO_API_BASE}/coins/markets?vs_currency=usd&order=market_cap_desc&per_page=250&page={page}"
+            )
+            response.raise_for_status()
+            ranked.extend(response.json())
+    except (httpx.HTTPError, ValueError) as e: # ValueError: body wasn't valid JSON
+        logger.warning(f"Error fetching CoinGecko market ranking, shared tickers use list order: {e}")
+    return ranked
+
+async def load_symbol_map():
+    """Fetches /coins/list (plus the market-cap ranking) and refreshes the symbol map.
+
+    On failure the previous map is kept and the next attempt is deferred by
+    SYMBOL_MAP_RETRY, so an outage doesn't turn every cache miss into a download.
+    """
+    try:
+        response = await _get(f"{COINGECKO_API_BASE}/coins/list")
+        response.raise_for_status()
+        coins = response.json()
+        _symbol_map["ids"] = build_symbol_map(coins, await fetch_ranked_coins())
+        _symbol_map["refresh_at"] = time.monotonic() + SYMBOL_MAP_TTL
+        logger.info(f"Loaded {len(_symbol_map['ids'])} CoinGecko symbols.")
+    except (httpx.HTTPError, ValueError) as e: # ValueError: body wasn't valid JSON
+        _symbol_map["refresh_at"] = time.monotonic() + SYMBOL_MAP_RETRY
+        logger.error(f"Error loading CoinGecko symbol map, retrying in {SYMBOL_MAP_RETRY}s: {e}")
+
+def _symbol_map_due():
+    """True if the symbol map has never been loaded or its refresh time has passed."""
+    refresh_at = _symbol_map["refresh_at"]
+    return refresh_at is None or time.monotonic() >= refresh_at
+
+async def get_symbol_map():
+    """Returns the symbol -> coin id map, refetching it once its refresh time has passed."""
+    if _symbol_map_due():
+        async with _symbol_map_lock:
+            # Re-check: another caller may have refreshed the map while we waited
+            if _symbol_map_due():
+                await load_symbol_map()
+    return _symbol_map["ids"]
+
+def get_cached_prices(symbols, max_age=PRICE_CACHE_TTL):
+    """Returns the cached prices younger than max_age seconds, without touching the network."""
+    now = time.monotonic()
+    prices = {}
+    for s in symbols:
+        cached = _price_cache.get(s.upper())
+        if cached and now - cached[1] < max_age:
+            prices[s.upper()] = cached[0]
+    return prices
+
+async def get_current_prices_for_symbols(symbols, max_age=PRICE_CACHE_TTL):
+    """Fetches current USD prices for a list of symbols, keyed by upper-case symbol.
+
+    Symbols with a cached price younger than max_age seconds are served from
+    the cache; only the remaining ones are requested in a single batched call.
+    """
+    if not symbols:
+        return {}
+    prices = get_cached_prices(symbols, max_age)
+    missing = [s for s in symbols if s.upper() not in prices]
+    if not missing:
+        return prices
+    # CoinGecko prices by coin id; remember which user symbols asked for each id
+    symbol_map = await get_symbol_map()
+    symbols_by_id = {}
+    for s in missing:
+        symbols_by_id.setdefault(symbol_map.get(s.lower(), s.lower()), []).append(s.upper())
+    try:
+        ids = ",".join(symbols_by_id)
+        response = await _get(f"{COINGECKO_API_BASE}/simple/price?ids={ids}&vs_currencies=usd")
+        response.raise_for_status() # Raise an exception for HTTP errors
+        data = response.json()
+        # Delisted or inactive coins come back as {"<id>": {}}; they simply have no price
+        fetched = {
+            symbol: v['usd']
+            for k, v in data.items() if v.get('usd') is not None
+            for symbol in symbols_by_id.get(k, ())
+        }
+    except (httpx.HTTPError, ValueError) as e: # ValueError: body wasn't valid JSON
+        logger.error(f"Error fetching prices for {', '.join(missing)}: {e}")
+        return prices
+    fetched_at = time.monotonic()
+    for symbol, price in fetched.items():
+        _price_cache[symbol] = (price, fetched_at)
+    prices.update(fetched)
+    return prices
+
+async def get_crypto_price(symbol):
+    """Fetches the USD price of a single symbol, or None if CoinGecko doesn't know it."""
+    prices = await get_current_prices_for_symbols([symbol])
+    return prices.get(symbol.upper())
+
+async def close():
+    """Closes the shared HTTP client."""
+    await _http_client.aclose()
@@ -1,73 +1,195 @@
 import sqlite3
 import os
+import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
 
 DATABASE_NAME = os.environ.get("DATABASE_NAME", "alerts.db") # Use an env var for DB path
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5")) # Connections kept open and reused
+CONNECT_RETRIES = 5 # Attempts before giving up on a locked database
+
+# Applied to every new connection. journal_mode=WAL is persistent and is set once in init_db().
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL", # Safe with WAL; fsyncs at checkpoints instead of every commit
+    "PRAGMA busy_timeout=30000", # Wait up to 30s for a lock instead of failing with SQLITE_BUSY
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000", # ~20MB page cache per connection
+)
 
 def get_db_connection():
-    """Establishes and returns a database connection."""
-    conn = sqlite3.connect(DATABASE_NAME)
-    conn.row_factory = sqlite3.Row # Allows accessing columns by name
-    return conn
+    """Establishes and returns a configured database connection, retrying while the database is locked."""
+    delay = 0.1
+    for attempt in range(CONNECT_RETRIES):
+        try:
+            # check_same_thread=False lets pooled connections be borrowed from any thread
+            conn = sqlite3.connect(DATABASE_NAME, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row # Allows accessing columns by name
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            return conn
+        except sqlite3.OperationalError as e:
+            if "database is locked" not in str(e) or attempt == CONNECT_RETRIES - 1:
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+class ConnectionPool:
+    """A fixed-size pool of SQLite connections, opened lazily and reused across calls.
+
+    The bot calls the helpers below from worker threads (asyncio.to_thread), so a
+    lock wait (up to busy_timeout) blocks one worker, not the event loop; the pool
+    size bounds how many queries run at once.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._created = 0
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def get(self):
+        """Returns an idle connection, opening a new one while the pool is below size."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_open = self._created < self._size
+            if can_open:
+                self._created += 1
+        if can_open:
+            try:
+                return get_db_connection()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get() # Pool exhausted; wait for a connection to be returned
+
+    def put_back(self, conn):
+        """Returns a connection to the pool, rolling back anything left uncommitted."""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+_pool = ConnectionPool(POOL_SIZE)
+
+@contextmanager
+def borrow():
+    """Borrows a pooled connection for the duration of the with-block."""
+    conn = _pool.get()
+    try:
+        yield conn
+    finally:
+        _pool.put_back(conn)
 
 def init_db():
     """Initializes the database schema if it doesn't exist."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            symbol TEXT NOT NULL,
-            target_price REAL NOT NULL,
-            status TEXT DEFAULT 'active' -- 'active', 'triggered', 'deactivated'
+    with borrow() as conn:
+        # WAL lets the alert checker write while the bot reads (and vice versa)
+        journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if journal_mode.lower() != "wal":
+            print(f"Warning: could not enable WAL, journal_mode is '{journal_mode}'.")
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                symbol TEXT NOT NULL,
+                target_price REAL NOT NULL,
+                status TEXT DEFAULT 'active' -- 'active', 'triggered', 'deactivated'
+            )
+        ''')
+        # Symbols are stored upper-case; normalize rows written before that was enforced
+        cursor.execute("UPDATE alerts SET symbol=UPPER(symbol) WHERE symbol<>UPPER(symbol)")
+        # Partial index: only the (small, hot) set of active alerts polled by the alert checker
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_alerts_status ON alerts(status) WHERE status='active'"
+        )
+        # Serves the alert sweep: one index range (symbol=?, target_price<=?) per priced symbol
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_alerts_active_symbol ON alerts(symbol, target_price) WHERE status='active'"
+        )
+        # Serves /myalerts and /delete_alert lookups by user
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_alerts_user_status ON alerts(user_id, status)"
         )
-    ''')
-    conn.commit()
-    conn.close()
+        conn.commit()
     print("Database initialized.")
 
 def add_alert(chat_id, user_id, symbol, target_price):
-    """Adds a new alert to the database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO alerts (chat_id, user_id, symbol, target_price) VALUES (?, ?, ?, ?)",
-        (chat_id, user_id, symbol, target_price)
-    )
-    conn.commit()
-    conn.close()
+    """Adds a new alert to the database, storing the symbol upper-case."""
+    with borrow() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO alerts (chat_id, user_id, symbol, target_price) VALUES (?, ?, ?, ?)",
+            (chat_id, user_id, symbol.upper(), target_price)
+        )
+        conn.commit()
 
 def get_active_alerts_for_user(user_id):
     """Retrieves all active alerts for a given user."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, symbol, target_price FROM alerts WHERE user_id=? AND status='active'",
-        (user_id,)
-    )
-    alerts = cursor.fetchall()
-    conn.close()
-    return alerts
-
-def get_all_active_alerts():
-    """Retrieves all active alerts from the database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, chat_id, user_id, symbol, target_price FROM alerts WHERE status='active'"
-    )
-    alerts = cursor.fetchall()
-    conn.close()
-    return alerts
+    with borrow() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, symbol, target_price FROM alerts WHERE user_id=? AND status='active'",
+            (user_id,)
+        )
+        return cursor.fetchall()
 
 def deactivate_alert(alert_id):
     """Deactivates an alert by its ID."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE alerts SET status='deactivated' WHERE id=?",
-        (alert_id,)
-    )
-    conn.commit()
-    conn.close()
+    with borrow() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE alerts SET status='deactivated' WHERE id=?",
+            (alert_id,)
+        )
+        conn.commit()
+
+def deactivate_alerts(alert_ids):
+    """Deactivates several alerts in a single statement and transaction."""
+    if not alert_ids:
+        return
+    placeholders = ",".join("?" * len(alert_ids))
+    with borrow() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"UPDATE alerts SET status='deactivated' WHERE id IN ({placeholders})",
+            list(alert_ids)
+        )
+        conn.commit()
+
+def get_min_target_prices():
+    """Returns {symbol: lowest active target price} for every symbol with an active alert."""
+    with borrow() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT symbol, MIN(target_price) AS min_target FROM alerts WHERE status='active' GROUP BY symbol"
+        )
+        return {row['symbol']: row['min_target'] for row in cursor.fetchall()}
+
+def get_triggered_alerts(symbol_price_map):
+    """Retrieves active alerts whose target is at or below the current price of their symbol.
+
+    symbol_price_map maps upper-case symbols to current USD prices. It is passed as a
+    single JSON parameter and json_each drives the loop (CROSS JOIN pins the order):
+    each priced symbol does one range search on idx_alerts_active_symbol, so the
+    cost scales with the number of triggered alerts, not the number of active ones.
+    """
+    if not symbol_price_map:
+        return []
+    with borrow() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT alerts.id, alerts.chat_id, alerts.symbol, alerts.target_price
+            FROM json_each(?) AS prices CROSS JOIN alerts ON alerts.symbol = prices.key
+            WHERE alerts.status='active' AND alerts.target_price <= prices.value
+            """,
+            (json.dumps(symbol_price_map),)
+        )
+        return cursor.fetchall()